@@ -1,31 +1,83 @@
 import yaml
+try:
+    # libyaml-backed C loader; ~5-10x faster than the pure-Python parser.
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
 import csv
+import copy
 import logging
+import os
+from collections import OrderedDict
+from threading import Lock
 
 logger = logging.getLogger(__name__)
 
+# Cache of parsed YAML files keyed by path, invalidated when the file on disk
+# changes (mtime/size/inode). Bounded LRU so unrelated one-off loads cannot
+# grow it without limit.
+_YAML_CACHE = OrderedDict()
+_YAML_CACHE_MAX = 100
+_yaml_cache_lock = Lock()
+
+def _stat_signature(file_path):
+    """Return a signature that changes whenever the file content may have changed."""
+    st = os.stat(file_path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
 def load_yaml(file_path):
     try:
-        with open(file_path, 'r') as f:
-            return yaml.safe_load(f)
+        signature = _stat_signature(file_path)
+        with _yaml_cache_lock:
+            cached = _YAML_CACHE.get(file_path)
+            if cached is not None and cached[0] == signature:
+                _YAML_CACHE.move_to_end(file_path)
+                # Deepcopy so callers can mutate the result without
+                # poisoning the cache.
+                return copy.deepcopy(cached[1])
+        # Open in binary mode so libyaml consumes bytes directly instead of
+        # going through Python's text decoder first.
+        with open(file_path, 'rb') as f:
+            data = yaml.load(f, Loader=_YamlLoader)
+        with _yaml_cache_lock:
+            _YAML_CACHE[file_path] = (signature, data)
+            _YAML_CACHE.move_to_end(file_path)
+            while len(_YAML_CACHE) > _YAML_CACHE_MAX:
+                _YAML_CACHE.popitem(last=False)
+        return copy.deepcopy(data)
     except Exception as e:
         logger.error(f"Error loading YAML file {file_path}: {e}")
         raise
 
-def load_csv(file_path):
+# Parsed-CSV cache, same scheme as the YAML cache above.
+_CSV_CACHE = {}
+_csv_cache_lock = Lock()
+
+_BOOL_MAP = {'true': True, 'false': False}
+
+def load_csv(file_path, bool_cols=('enabled',)):
     try:
+        signature = _stat_signature(file_path)
+        with _csv_cache_lock:
+            cached = _CSV_CACHE.get(file_path)
+            if cached is not None and cached[0] == signature:
+                return copy.deepcopy(cached[1])
         with open(file_path, 'r') as f:
             reader = csv.DictReader(f)
-            # Convert boolean strings to booleans
+            # Convert boolean strings to booleans, but only in the columns
+            # that hold booleans instead of scanning every cell.
             data = []
             for row in reader:
-                for key, value in row.items():
-                    if isinstance(value, str) and value.lower() == 'true':
-                        row[key] = True
-                    elif isinstance(value, str) and value.lower() == 'false':
-                        row[key] = False
+                for key in bool_cols:
+                    value = row.get(key)
+                    if type(value) is str:
+                        converted = _BOOL_MAP.get(value.lower())
+                        if converted is not None:
+                            row[key] = converted
                 data.append(row)
-            return data
+        with _csv_cache_lock:
+            _CSV_CACHE[file_path] = (signature, data)
+        return copy.deepcopy(data)
     except Exception as e:
         logger.error(f"Error loading CSV file {file_path}: {e}")
         raise
@@ -35,12 +87,13 @@ class Config:
     _config = load_yaml('config.yaml')
     SCRAPE_INTERVAL = _config.get('scrape_interval_minutes', 5)
     TIMEOUT = _config.get('timeout_seconds', 60)
+    MAX_WORKERS = _config.get('max_workers', 10)
 
     # Load loyalty program configuration
     LOYALTY_NAMES = _config.get('loyalty_program', {}).get('names', ['rewards 2 go'])
 
     # Load commanders
-    COMMANDERS = load_csv('commanders.csv')
+    COMMANDERS = load_csv('commanders.csv', bool_cols=('enabled',))
 
     # Load credentials
     _credentials = load_yaml('credentials.yaml')
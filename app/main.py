@@ -1,6 +1,9 @@
 import time
 import logging
+from datetime import datetime
 import csv
+import os
+import sys
 import requests
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from prometheus_client import start_http_server, Gauge, Counter, Histogram, Info
@@ -48,36 +51,51 @@ consecutive_failures = Gauge('posproctor_consecutive_failures', 'Number of conse
 
 # Global failure tracking for consecutive errors
 _consecutive_failures_tracker = {}
+# Human-readable timestamp formatted once per scrape cycle; Info transitions
+# reuse it instead of each calling strftime.
+_cycle_time_str = datetime.now().isoformat(sep=' ', timespec='seconds')
+# Last Info state emitted per commander, as (status, error_type, error_message).
+# The Info child is only re-emitted when this tuple changes, so steady-state
+# cycles (healthy or stuck on the same error) skip the Info bookkeeping.
+_last_state_tracker = {}
 
 def _update_error_state(store, ip, group, brand, error_type, error_message, is_success=False):
     """Update error state tracking for a commander."""
     key = f"{ip}:{store}"
-    
+
     if is_success:
         # Reset consecutive failures on success
         _consecutive_failures_tracker[key] = 0
-        consecutive_failures.labels(store=store, ip=ip, group=group, brand=brand).set(0)
-        last_successful_connection.labels(store=store, ip=ip, group=group, brand=brand).set(time.time())
-        commander_error_state.labels(store=store, ip=ip, group=group, brand=brand).info({
-            'status': 'healthy',
-            'last_error_type': '',
-            'last_error_message': '',
-            'last_success_time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-        })
+        consecutive_failures.labels(store, ip, group, brand).set(0)
+        last_successful_connection.labels(store, ip, group, brand).set(time.time())
+
+        new_state = ('healthy', '', '')
+        if _last_state_tracker.get(key) != new_state:
+            _last_state_tracker[key] = new_state
+            commander_error_state.labels(store, ip, group, brand).info({
+                'status': 'healthy',
+                'last_error_type': '',
+                'last_error_message': '',
+                'last_success_time': _cycle_time_str
+            })
     else:
         # Increment consecutive failures
         current_failures = _consecutive_failures_tracker.get(key, 0) + 1
         _consecutive_failures_tracker[key] = current_failures
-        consecutive_failures.labels(store=store, ip=ip, group=group, brand=brand).set(current_failures)
-        
-        # Update error state with detailed information
-        commander_error_state.labels(store=store, ip=ip, group=group, brand=brand).info({
-            'status': 'error',
-            'last_error_type': error_type,
-            'last_error_message': error_message,
-            'consecutive_failures': str(current_failures),
-            'last_error_time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-        })
+        consecutive_failures.labels(store, ip, group, brand).set(current_failures)
+
+        # Update error state with detailed information, but only when the
+        # error actually changed; the gauge above carries the live count.
+        new_state = ('error', error_type, error_message)
+        if _last_state_tracker.get(key) != new_state:
+            _last_state_tracker[key] = new_state
+            commander_error_state.labels(store, ip, group, brand).info({
+                'status': 'error',
+                'last_error_type': error_type,
+                'last_error_message': error_message,
+                'consecutive_failures': str(current_failures),
+                'last_error_time': _cycle_time_str
+            })
 
 def fetch_commander_metrics(commander):
     """Fetches metrics for a single commander and updates Prometheus gauges."""
@@ -85,23 +103,19 @@ def fetch_commander_metrics(commander):
     ip = commander['ip']
     group = commander['group']
     brand = commander.get('brand', 'Unknown')
+    metrics = commander['_metrics']
+    lbl4 = commander['_lbl4']
     logger.info(f"Fetching metrics for commander: {store} ({ip}) - {brand}")
     
-    start_time = time.time()
     concurrent_queries.inc()
     
     try:
-        client = VerifoneAPIClient(
-            ip=ip,
-            username=Config.USERNAME,
-            password=Config.PASSWORD,
-            timeout=Config.TIMEOUT
-        )
-        
+        client = _get_client(ip)
+
         # Fetch and process forecourt diagnostics
-        diagnostics_start = time.time()
+        diagnostics_start = time.monotonic_ns()
         xml_data = client.get_forecourt_diagnostics()
-        query_duration.labels(store=store, ip=ip, group=group, brand=brand, endpoint='diagnostics').observe(time.time() - diagnostics_start)
+        metrics['qd_diagnostics'].observe((time.monotonic_ns() - diagnostics_start) / 1e9)
         
         has_diagnostics = False
         has_loyalty = False
@@ -110,143 +124,247 @@ def fetch_commander_metrics(commander):
             diagnostics = client.parse_diagnostics(xml_data)
             
             # Controller
-            controller_status.labels(store=store, ip=ip, group=group, brand=brand).set(diagnostics['controller_status'])
+            metrics['controller_status'].set(diagnostics['controller_status'])
 
             # Pumps
             for pump in diagnostics['pumps']:
-                pump_status.labels(store=store, ip=ip, fueling_point_id=pump['id'], group=group, brand=brand).set(pump['status'])
+                pump_status.labels(store, ip, pump['id'], group, brand).set(pump['status'])
 
             # DCRs
             for dcr in diagnostics['dcrs']:
-                dcr_status.labels(store=store, ip=ip, fueling_point_id=dcr['id'], group=group, brand=brand).set(dcr['status'])
+                dcr_status.labels(store, ip, dcr['id'], group, brand).set(dcr['status'])
 
             # Price Displays
             for display in diagnostics['price_displays']:
-                price_display_status.labels(store=store, ip=ip, display_id=display['id'], group=group, brand=brand).set(display['status'])
+                price_display_status.labels(store, ip, display['id'], group, brand).set(display['status'])
             
             has_diagnostics = True
         else:
             logger.warning(f"[{store}] No diagnostics data retrieved.")
-            query_failures.labels(store=store, ip=ip, group=group, brand=brand, error_type='no_data').inc()
+            metrics['qf_no_data'].inc()
 
         # Fetch and process loyalty FEP status
-        loyalty_start = time.time()
+        loyalty_start = time.monotonic_ns()
         loyalty_status_data = client.get_loyalty_fep_status(Config.LOYALTY_NAMES)
-        query_duration.labels(store=store, ip=ip, group=group, brand=brand, endpoint='loyalty').observe(time.time() - loyalty_start)
+        metrics['qd_loyalty'].observe((time.monotonic_ns() - loyalty_start) / 1e9)
 
         if loyalty_status_data:
-            loyalty_fep_status.labels(store=store, ip=ip, group=group, brand=brand).set(loyalty_status_data['loyalty_status'])
+            metrics['loyalty_fep_status'].set(loyalty_status_data['loyalty_status'])
             has_loyalty = True
         else:
             logger.warning(f"[{store}] No loyalty status data retrieved.")
-            query_failures.labels(store=store, ip=ip, group=group, brand=brand, error_type='no_loyalty_data').inc()
+            metrics['qf_no_loyalty_data'].inc()
 
         # Fetch and process primary FEP status
-        primary_fep_start = time.time()
+        primary_fep_start = time.monotonic_ns()
         primary_fep_data = client.get_primary_fep_status()
-        query_duration.labels(store=store, ip=ip, group=group, brand=brand, endpoint='primary_fep').observe(time.time() - primary_fep_start)
+        metrics['qd_primary_fep'].observe((time.monotonic_ns() - primary_fep_start) / 1e9)
 
         if primary_fep_data:
             fep_name = primary_fep_data['primary_fep_name']
             fep_status = primary_fep_data['primary_fep_status']
-            primary_fep_status.labels(store=store, ip=ip, group=group, brand=brand, fep_name=fep_name).set(fep_status)
+            primary_fep_status.labels(*lbl4, fep_name).set(fep_status)
             logger.debug(f"[{store}] Primary FEP {fep_name}: {'Connected' if fep_status else 'Disconnected'}")
         else:
             logger.warning(f"[{store}] No primary FEP status data retrieved.")
-            query_failures.labels(store=store, ip=ip, group=group, brand=brand, error_type='no_primary_fep_data').inc()
+            metrics['qf_no_primary_fep_data'].inc()
         
         # Only consider success if we got at least diagnostics data (loyalty is optional)
         if has_diagnostics:
-            scrape_success.labels(store=store, ip=ip, group=group, brand=brand).set(1)
+            metrics['scrape_success'].set(1)
             _update_error_state(store, ip, group, brand, '', '', is_success=True)
             logger.info(f"Successfully fetched metrics for {store} ({ip})")
         else:
-            scrape_success.labels(store=store, ip=ip, group=group, brand=brand).set(0)
+            metrics['scrape_success'].set(0)
             error_msg = "No diagnostics data retrieved from commander. Check commander status and API connectivity."
             _update_error_state(store, ip, group, brand, 'no_data', error_msg)
             logger.error(f"Failed to fetch diagnostics for {store} ({ip}): {error_msg}")
 
     except requests.exceptions.Timeout as e:
-        timeout_errors.labels(store=store, ip=ip, group=group, brand=brand).inc()
-        query_failures.labels(store=store, ip=ip, group=group, brand=brand, error_type='timeout').inc()
+        timeout_errors.labels(*lbl4).inc()
+        query_failures.labels(*lbl4, 'timeout').inc()
         error_msg = f"Connection timeout after {Config.TIMEOUT}s"
         logger.error(f"Timeout error for commander {store} ({ip}): {error_msg}")
         _update_error_state(store, ip, group, brand, 'timeout', error_msg)
-        scrape_success.labels(store=store, ip=ip, group=group, brand=brand).set(0)
+        metrics['scrape_success'].set(0)
     except requests.exceptions.ConnectionError as e:
-        connection_errors.labels(store=store, ip=ip, group=group, brand=brand).inc()
-        query_failures.labels(store=store, ip=ip, group=group, brand=brand, error_type='connection').inc()
+        connection_errors.labels(*lbl4).inc()
+        query_failures.labels(*lbl4, 'connection').inc()
         error_msg = f"Cannot connect to commander at {ip}. Check network connectivity and commander status."
         logger.error(f"Connection error for commander {store} ({ip}): {error_msg}")
         _update_error_state(store, ip, group, brand, 'connection', error_msg)
-        scrape_success.labels(store=store, ip=ip, group=group, brand=brand).set(0)
+        metrics['scrape_success'].set(0)
     except requests.exceptions.HTTPError as e:
         if e.response.status_code == 401:
-            auth_failures.labels(store=store, ip=ip, group=group, brand=brand).inc()
-            query_failures.labels(store=store, ip=ip, group=group, brand=brand, error_type='auth').inc()
+            auth_failures.labels(*lbl4).inc()
+            query_failures.labels(*lbl4, 'auth').inc()
             error_msg = f"Authentication failed. Check credentials for {ip}."
         else:
-            query_failures.labels(store=store, ip=ip, group=group, brand=brand, error_type='http_error').inc()
+            query_failures.labels(*lbl4, 'http_error').inc()
             error_msg = f"HTTP {e.response.status_code}: {e.response.reason}"
         logger.error(f"HTTP error for commander {store} ({ip}): {error_msg}")
         _update_error_state(store, ip, group, brand, 'http_error', error_msg)
-        scrape_success.labels(store=store, ip=ip, group=group, brand=brand).set(0)
+        metrics['scrape_success'].set(0)
     except Exception as e:
         logger.error(f"Error fetching metrics for commander {store} ({ip}): {e}")
-        query_failures.labels(store=store, ip=ip, group=group, brand=brand, error_type='unknown').inc()
+        query_failures.labels(*lbl4, 'unknown').inc()
         error_msg = f"Unexpected error: {str(e)}"
         _update_error_state(store, ip, group, brand, 'unknown', error_msg)
-        scrape_success.labels(store=store, ip=ip, group=group, brand=brand).set(0)
+        metrics['scrape_success'].set(0)
     finally:
         concurrent_queries.dec()
 
+# API clients reused across cycles, keyed by commander IP.
+_clients = {}
+
+def _get_client(ip):
+    """Return the cached VerifoneAPIClient for an IP, creating it on first use."""
+    client = _clients.get(ip)
+    if client is None:
+        client = _clients[ip] = VerifoneAPIClient(
+            ip=ip,
+            username=Config.USERNAME,
+            password=Config.PASSWORD,
+            timeout=Config.TIMEOUT
+        )
+    return client
+
+def _prune_clients(active_ips):
+    """Drop cached clients for commanders no longer in the CSV."""
+    for ip in list(_clients):
+        if ip not in active_ips:
+            del _clients[ip]
+
+def _bind_commander_metrics(commander):
+    """Pre-bind the fixed-label metric children for a commander.
+
+    .labels() hashes its arguments and does a child lookup on every call;
+    binding once per commander at load time keeps that work out of the
+    per-scrape hot path. Children whose label sets vary per call (pumps,
+    DCRs, displays, error types) are still bound at use time.
+    """
+    store = commander['store']
+    ip = commander['ip']
+    group = commander['group']
+    brand = commander.get('brand', 'Unknown')
+    # Interned label tuple reused by every dynamic .labels() call for this
+    # commander; interning caches the string hashes so child lookups reduce
+    # to pointer comparisons.
+    commander['_lbl4'] = lbl4 = (sys.intern(store), sys.intern(ip), sys.intern(group), sys.intern(brand))
+    commander['_metrics'] = {
+        'scrape_success': scrape_success.labels(*lbl4),
+        'controller_status': controller_status.labels(*lbl4),
+        'loyalty_fep_status': loyalty_fep_status.labels(*lbl4),
+        'qd_diagnostics': query_duration.labels(*lbl4, 'diagnostics'),
+        'qd_loyalty': query_duration.labels(*lbl4, 'loyalty'),
+        'qd_primary_fep': query_duration.labels(*lbl4, 'primary_fep'),
+        'qf_no_data': query_failures.labels(*lbl4, 'no_data'),
+        'qf_no_loyalty_data': query_failures.labels(*lbl4, 'no_loyalty_data'),
+        'qf_no_primary_fep_data': query_failures.labels(*lbl4, 'no_primary_fep_data'),
+    }
+
+# Cached parse of commanders.csv keyed by its stat signature, so unchanged
+# files skip the re-parse (and keep their metric bindings) across cycles.
+_commanders_cache = {'signature': None, 'enabled': [], 'all': []}
+
 def load_commanders():
-    """Loads commanders from the CSV file."""
-    commanders = []
+    """Loads commanders from the CSV file.
+
+    Returns (enabled, all, changed); when the file is unchanged since the
+    last cycle the cached rows are returned and changed is False.
+    """
+    try:
+        st = os.stat('/app/commanders.csv')
+        signature = (st.st_mtime_ns, st.st_size)
+        if signature == _commanders_cache['signature']:
+            return _commanders_cache['enabled'], _commanders_cache['all'], False
+    except FileNotFoundError:
+        signature = None
+
+    enabled = []
+    all_commanders = []
     try:
-        with open('/app/commanders.csv', mode='r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                if row.get('enabled', 'false').lower() == 'true':
-                    commanders.append(row)
+        with open('/app/commanders.csv', mode='r', encoding='utf-8', newline='') as csvfile:
+            # csv.reader + header indices instead of DictReader: rows stay
+            # tuples and we only build a dict for the columns we use.
+            reader = csv.reader(csvfile)
+            try:
+                header = next(reader)
+            except StopIteration:
+                header = []
+            idx = {name: i for i, name in enumerate(header)}
+            columns = [(name, idx[name]) for name in ('store', 'ip', 'group', 'brand', 'enabled') if name in idx]
+            enabled_idx = idx.get('enabled')
+            for values in reader:
+                row = {name: values[i] for name, i in columns if i < len(values)}
+                all_commanders.append(row)
+                if enabled_idx is not None and enabled_idx < len(values) and values[enabled_idx].lower() == 'true':
+                    # The CSV is operator-supplied via the web upload; an odd
+                    # header must not take the daemon down, so skip enabled
+                    # rows missing a label field instead of letting
+                    # _bind_commander_metrics raise KeyError.
+                    missing = [name for name in ('store', 'ip', 'group', 'brand') if name not in row]
+                    if missing:
+                        logger.warning(f"Skipping enabled commander row missing {', '.join(missing)}: {values}")
+                        continue
+                    _bind_commander_metrics(row)
+                    enabled.append(row)
     except FileNotFoundError:
         logger.error("commanders.csv file not found. Please ensure it is mounted in /app/commanders.csv")
-    return commanders
+    _prune_clients({commander['ip'] for commander in enabled})
+    _commanders_cache['signature'] = signature
+    _commanders_cache['enabled'] = enabled
+    _commanders_cache['all'] = all_commanders
+    return enabled, all_commanders, True
 
-def fetch_all_commanders_parallel(commanders, max_workers=10):
+def _fetch_one(commander):
+    """Run a single commander fetch, containing any unexpected exception."""
+    try:
+        fetch_commander_metrics(commander)
+    except Exception as e:
+        logger.error(f"Exception occurred for commander {commander['store']} ({commander['ip']}): {e}")
+
+# Persistent worker pool shared across scrape cycles. The fan-out is purely
+# network-bound, so the threads spend their time blocked in requests; reusing
+# the pool avoids re-spawning max_workers OS threads every cycle.
+_executor = None
+
+def _get_executor(max_workers):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scrape')
+    return _executor
+
+def fetch_all_commanders_parallel(commanders, max_workers=Config.MAX_WORKERS):
     """Fetch metrics for all commanders in parallel using ThreadPoolExecutor."""
+    global _cycle_time_str
+    _cycle_time_str = datetime.now().isoformat(sep=' ', timespec='seconds')
     logger.info(f"Starting parallel fetch for {len(commanders)} commanders with {max_workers} workers")
-    
-    cycle_start_time = time.time()
-    
+
+    cycle_start_time = time.monotonic_ns()
+
     with scrape_cycle_duration.labels(workers=str(max_workers)).time():
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Update thread pool metrics
-            thread_pool_active.set(max_workers)
-            
-            # Submit all tasks
-            future_to_commander = {
-                executor.submit(fetch_commander_metrics, commander): commander 
-                for commander in commanders
-            }
-            
-            # Process completed tasks as they finish
-            completed = 0
-            for future in as_completed(future_to_commander):
-                commander = future_to_commander[future]
-                try:
-                    future.result()  # This will raise any exception that occurred
-                    completed += 1
-                    if completed % 5 == 0:  # Log progress every 5 completions
-                        logger.info(f"Completed {completed}/{len(commanders)} commanders")
-                except Exception as e:
-                    logger.error(f"Exception occurred for commander {commander['store']} ({commander['ip']}): {e}")
+        executor = _get_executor(max_workers)
+        # Update thread pool metrics
+        thread_pool_active.set(max_workers)
+
+        # Submit all tasks; _fetch_one contains any exception and knows its
+        # commander, so no future-to-commander reverse mapping is needed.
+        futures = [executor.submit(_fetch_one, commander) for commander in commanders]
+
+        # Process completed tasks as they finish
+        completed = 0
+        for future in as_completed(futures):
+            future.result()
+            completed += 1
+            if completed % 5 == 0:  # Log progress every 5 completions
+                logger.info(f"Completed {completed}/{len(commanders)} commanders")
     
     # Update metrics
     last_scrape_timestamp.set(time.time())
     thread_pool_active.set(0)
     
-    cycle_duration = time.time() - cycle_start_time
+    cycle_duration = (time.monotonic_ns() - cycle_start_time) / 1e9
     logger.info(f"Parallel fetch completed for all {len(commanders)} commanders in {cycle_duration:.2f}s")
 
 def main():
@@ -258,38 +376,36 @@ def main():
         'version': '2.2',
         'scrape_interval': str(Config.SCRAPE_INTERVAL),
         'timeout': str(Config.TIMEOUT),
-        'max_workers': '10'
+        'max_workers': str(Config.MAX_WORKERS)
     })
     
     time.sleep(5)
     start_http_server(8000)
     logger.info("Prometheus metrics server started on port 8000")
 
+    prewarmed = False
     while True:
-        commanders = load_commanders()
-        all_commanders = []
-        
-        # Load all commanders for total count metrics
-        try:
-            with open('/app/commanders.csv', mode='r', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    all_commanders.append(row)
-        except FileNotFoundError:
-            logger.error("commanders.csv file not found")
-        
-        # Update commander count metrics
-        enabled_count = len([c for c in all_commanders if c.get('enabled', 'false').lower() == 'true'])
-        disabled_count = len(all_commanders) - enabled_count
-        
-        total_commanders.labels(enabled='true').set(enabled_count)
-        total_commanders.labels(enabled='false').set(disabled_count)
+        commanders, all_commanders, changed = load_commanders()
+
+        # Update commander count metrics; the counts can only move when the
+        # CSV itself changed.
+        if changed:
+            total_commanders.labels(enabled='true').set(len(commanders))
+            total_commanders.labels(enabled='false').set(len(all_commanders) - len(commanders))
+
+        # Pay the TCP+TLS handshakes before the first timed scrape cycle;
+        # done off the first in-loop load so that load's changed=True result
+        # (and the gauges above) aren't consumed by a warm-up call.
+        if not prewarmed:
+            if commanders:
+                VerifoneAPIClient.prewarm([commander['ip'] for commander in commanders])
+            prewarmed = True
         
         if not commanders:
             logger.warning("No enabled commanders found in commanders.csv. Nothing to monitor.")
         else:
             VerifoneAPIClient.reset_failed_attempts()
-            fetch_all_commanders_parallel(commanders, max_workers=10)
+            fetch_all_commanders_parallel(commanders, max_workers=Config.MAX_WORKERS)
         
         logger.info(f"Completed scrape cycle. Waiting for {Config.SCRAPE_INTERVAL} minutes.")
         time.sleep(Config.SCRAPE_INTERVAL * 60)
@@ -3,9 +3,13 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import logging
 import urllib3
+from io import BytesIO
 from lxml import etree
 import atexit
+import random
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from threading import Lock
 
 # Suppress InsecureRequestWarning
@@ -13,17 +17,57 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
 
+# Connection-pool sizing for the shared session. One pool per commander host;
+# keep-alive sockets amortize the TCP+TLS handshake across the three endpoint
+# fetches per cycle and across cycles.
+POOL_CONNECTIONS = 20
+POOL_MAXSIZE = 100
+
+# The device only ever emits a handful of casings for its boolean-ish
+# fields; set membership avoids allocating a lowercased copy per element.
+_TRUE = frozenset({'true', 'True', 'TRUE'})
+_FALSE = frozenset({'false', 'False', 'FALSE'})
+
+# Tuned parser for the small trusted responses we still parse eagerly
+# (validate). Skipping ID collection, blank text nodes, and entity
+# resolution trims per-parse work and hardens against entity expansion.
+_PARSER = etree.XMLParser(
+    collect_ids=False,
+    remove_blank_text=True,
+    huge_tree=False,
+    resolve_entities=False,
+)
+
 class VerifoneAPIClient:
-    # Class-level dictionary to track failed attempts per IP
-    _failed_attempts = {}
+    # Compiled XPath for the auth path; libxml2 compiles the expression
+    # once instead of re-interpreting an ElementPath string per call.
+    _COOKIE_XPATH = etree.XPath("string(.//cookie)")
+    # Per-IP failure state: ip -> (attempts, next_retry_at). Failed
+    # commanders back off exponentially (with jitter) instead of being
+    # locked out for the process lifetime.
+    _failed_state = {}
+    # Backoff policy for recoverable auth failures (timeouts, 5xx, resets).
+    _BACKOFF_BASE = 1.0
+    _BACKOFF_CAP = 30.0
+    _BACKOFF_JITTER = 0.5
     # Shared session with connection pooling
     _shared_session = None
-    # Token cache with expiration tracking
-    _token_cache = {}
+    # Token cache with expiration tracking; LRU-ordered so eviction drops
+    # the least recently used entry in O(1) instead of scanning timestamps
+    _token_cache = OrderedDict()
     # Lock for thread-safe token operations
     _token_lock = Lock()
+    # Per-cache-key locks so only one thread authenticates against a given
+    # commander at a time; the rest wait and reuse the freshly cached token.
+    _key_locks = {}
+    _key_locks_guard = Lock()
     # Default token TTL (20 minutes to account for inactivity timer)
     _default_token_ttl = 1200
+    # Short-lived vpaymentdiagnostics bodies: ip -> (fetched_at, bytes). The
+    # loyalty and primary-FEP getters hit the same endpoint within one poll,
+    # so a few seconds of reuse halves the HTTPS round trips.
+    _payment_cache = {}
+    _PAYMENT_CACHE_TTL = 5.0
 
     @classmethod
     def _get_shared_session(cls):
@@ -33,11 +77,15 @@ class VerifoneAPIClient:
             retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
             adapter = HTTPAdapter(
                 max_retries=retries,
-                pool_connections=20,  # Number of connection pools to cache
-                pool_maxsize=100      # Maximum number of connections to save in the pool
+                pool_connections=POOL_CONNECTIONS,
+                pool_maxsize=POOL_MAXSIZE
             )
             cls._shared_session.mount('https://', adapter)
             cls._shared_session.mount('http://', adapter)
+            # Ask the commander for compressed bodies; urllib3 decompresses
+            # transparently. Diagnostic XML is highly repetitive, so this
+            # trades a little CPU for a much smaller transfer.
+            cls._shared_session.headers['Accept-Encoding'] = 'gzip, deflate'
             # Register cleanup on exit
             atexit.register(cls._cleanup_session)
         return cls._shared_session
@@ -48,22 +96,23 @@ class VerifoneAPIClient:
         if cls._shared_session:
             cls._shared_session.close()
             cls._shared_session = None
-        # Clean up token cache
+        # Clean up caches
         cls._token_cache.clear()
+        cls._payment_cache.clear()
 
     @classmethod
     def _get_cached_token(cls, cache_key):
         """Get a cached token if it's still valid."""
         with cls._token_lock:
-            if cache_key in cls._token_cache:
-                token_data = cls._token_cache[cache_key]
+            token_data = cls._token_cache.get(cache_key)
+            if token_data is not None:
                 if time.time() < token_data['expires_at']:
                     logger.debug(f"Using cached token for {cache_key}")
+                    cls._token_cache.move_to_end(cache_key)
                     return token_data['token']
-                else:
-                    # Token expired, remove from cache
-                    logger.debug(f"Cached token expired for {cache_key}")
-                    del cls._token_cache[cache_key]
+                # Token expired, remove from cache
+                logger.debug(f"Cached token expired for {cache_key}")
+                del cls._token_cache[cache_key]
             return None
 
     @classmethod
@@ -74,20 +123,48 @@ class VerifoneAPIClient:
         
         with cls._token_lock:
             # Implement basic cache size management (keep under 5 as per system limit)
-            if len(cls._token_cache) >= 5:
-                # Remove oldest token
-                oldest_key = min(cls._token_cache.keys(), 
-                               key=lambda k: cls._token_cache[k]['created_at'])
-                logger.debug(f"Cache full, removing oldest token for {oldest_key}")
-                del cls._token_cache[oldest_key]
-            
+            while len(cls._token_cache) >= 5:
+                evicted_key, _ = cls._token_cache.popitem(last=False)
+                logger.debug(f"Cache full, removing least recently used token for {evicted_key}")
+
             cls._token_cache[cache_key] = {
                 'token': token,
                 'created_at': time.time(),
                 'expires_at': time.time() + ttl
             }
+            cls._token_cache.move_to_end(cache_key)
             logger.debug(f"Cached token for {cache_key} (expires in {ttl}s)")
 
+    @classmethod
+    def _lock_for(cls, cache_key):
+        """Get or create the single-flight lock for a cache key."""
+        with cls._key_locks_guard:
+            lock = cls._key_locks.get(cache_key)
+            if lock is None:
+                lock = cls._key_locks[cache_key] = Lock()
+            return lock
+
+    @classmethod
+    def prewarm(cls, ips):
+        """Pre-open keep-alive sockets to the given commanders.
+
+        A cheap HEAD to each host pays the TCP+TLS handshake up front, so
+        the first timed validate/diagnostics request of the cycle rides an
+        already-negotiated connection. Failures are ignored — an unreachable
+        commander just warms nothing.
+        """
+        session = cls._get_shared_session()
+
+        def _warm(ip):
+            try:
+                session.head(f"https://{ip}/cgi-bin/CGILink", verify=False, timeout=5)
+            except requests.exceptions.RequestException:
+                pass
+
+        with ThreadPoolExecutor(max_workers=32, thread_name_prefix='prewarm') as executor:
+            list(executor.map(_warm, ips))
+        logger.debug(f"Prewarmed connections to {len(ips)} commanders")
+
     @classmethod
     def release_token(cls, cache_key):
         """Release a cached token when no longer required (best practice)."""
@@ -103,6 +180,9 @@ class VerifoneAPIClient:
         self.timeout = timeout
         self.session = self._get_shared_session()
         self.cache_key = f"{ip}:{username}"
+        # Built once; per-request query strings go through params= so
+        # requests handles encoding and credentials stay out of the URL
+        self._base_url = f"https://{ip}/cgi-bin/CGILink"
 
 
     def get_token(self):
@@ -112,126 +192,185 @@ class VerifoneAPIClient:
         if cached_token:
             return cached_token
 
-        # Check if this IP has reached the failure limit
-        if self._failed_attempts.get(self.ip, 0) >= 2:
-            logger.warning(f"[{self.ip}] Skipping authentication: 2 failed attempts reached.")
+        # Single-flight: hold this commander's lock while authenticating so
+        # concurrent callers don't each issue a validate request.
+        with self._lock_for(self.cache_key):
+            # Another thread may have authenticated while we waited.
+            cached_token = self._get_cached_token(self.cache_key)
+            if cached_token:
+                return cached_token
+            return self._authenticate()
+
+    def _record_failure(self, unrecoverable=False):
+        """Advance this IP's backoff state after a failed authentication.
+
+        Recoverable failures (timeouts, 5xx, connection resets) back off
+        exponentially with jitter, capped at _BACKOFF_CAP. Unrecoverable
+        failures (rejected credentials) are parked until the state is reset.
+        """
+        attempts = self._failed_state.get(self.ip, (0, 0.0))[0]
+        if unrecoverable:
+            next_retry_at = float('inf')
+        else:
+            delay = min(self._BACKOFF_CAP, self._BACKOFF_BASE * (2 ** attempts))
+            delay *= 1 + random.random() * self._BACKOFF_JITTER
+            next_retry_at = time.time() + delay
+        self._failed_state[self.ip] = (attempts + 1, next_retry_at)
+
+    def _authenticate(self):
+        """Issue the validate request; caller holds the cache-key lock."""
+        # Skip commanders that are still in their backoff window
+        failed = self._failed_state.get(self.ip)
+        if failed is not None and time.time() < failed[1]:
+            logger.warning(f"[{self.ip}] Skipping authentication: backing off after {failed[0]} failed attempts.")
             return None
 
         logger.debug(f"[{self.ip}] Attempting to authenticate")
-        url = f"https://{self.ip}/cgi-bin/CGILink?cmd=validate&user={self.username}&passwd={self.password}"
-        logger.debug(f"[{self.ip}] Requesting URL: {url}")
+        params = {'cmd': 'validate', 'user': self.username, 'passwd': self.password}
         try:
-            r = self.session.get(url, verify=False, timeout=self.timeout)
+            r = self.session.get(self._base_url, params=params, verify=False, timeout=self.timeout)
             logger.debug(f"[{self.ip}] Response status code: {r.status_code}")
             logger.debug(f"[{self.ip}] Response content: {r.content}")
             r.raise_for_status()
-            token = etree.fromstring(r.content).findtext(".//cookie")
+            token = self._COOKIE_XPATH(etree.fromstring(r.content, _PARSER))
             if not token:
                 logger.error(f"[{self.ip}] No token found in response.")
-                self._failed_attempts[self.ip] = self._failed_attempts.get(self.ip, 0) + 1
+                self._record_failure()
                 return None
             logger.debug(f"[{self.ip}] Token received: {token}")
-            # Reset failure count on success
-            self._failed_attempts[self.ip] = 0
+            # Clear failure state on success
+            self._failed_state.pop(self.ip, None)
             # Cache the token
             self._cache_token(self.cache_key, token)
             return token
         except (requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout) as e:
             logger.error(f"[{self.ip}] Connection timed out: {e}")
-            self._failed_attempts[self.ip] = self._failed_attempts.get(self.ip, 0) + 1
+            self._record_failure()
+            return None
+        except requests.exceptions.HTTPError as e:
+            # Rejected credentials won't get better with retries; park the
+            # commander until the failure state is reset.
+            unauthorized = e.response is not None and e.response.status_code == 401
+            logger.error(f"[{self.ip}] Failed to get token: {e}")
+            self._record_failure(unrecoverable=unauthorized)
             return None
         except requests.exceptions.RequestException as e:
             logger.error(f"[{self.ip}] Failed to get token: {e}")
-            self._failed_attempts[self.ip] = self._failed_attempts.get(self.ip, 0) + 1
+            self._record_failure()
             return None
 
     def get_forecourt_diagnostics(self):
-        """Fetch forecourt diagnostics from Verifone Commander API."""
+        """Fetch forecourt diagnostics from Verifone Commander API.
+
+        Returns the raw XML bytes; parse_diagnostics streams over them.
+        """
         token = self.get_token()
         if not token:
             return None
 
-        url = f"https://{self.ip}/cgi-bin/CGILink?cmd=vforecourtdiagnostics&cookie={token}"
+        params = {'cmd': 'vforecourtdiagnostics', 'cookie': token}
         try:
-            r = self.session.get(url, verify=False, timeout=self.timeout)
+            r = self.session.get(self._base_url, params=params, verify=False, timeout=self.timeout)
             r.raise_for_status()
-            return etree.fromstring(r.content)
+            return r.content
         except requests.exceptions.RequestException as e:
             logger.error(f"[{self.ip}] Failed to fetch diagnostics: {e}")
             return None
 
+    def _get_payment_diagnostics(self):
+        """Fetch the vpaymentdiagnostics body, shared briefly per commander.
+
+        Uses the single-flight lock so concurrent loyalty/primary callers in
+        the same poll issue one request and share the bytes.
+        """
+        entry = self._payment_cache.get(self.ip)
+        if entry is not None and time.time() - entry[0] < self._PAYMENT_CACHE_TTL:
+            return entry[1]
+
+        with self._lock_for(f"payment:{self.ip}"):
+            # Another thread may have fetched while we waited
+            entry = self._payment_cache.get(self.ip)
+            if entry is not None and time.time() - entry[0] < self._PAYMENT_CACHE_TTL:
+                return entry[1]
+
+            token = self.get_token()
+            if not token:
+                return None
+
+            params = {'cmd': 'vpaymentdiagnostics', 'cookie': token}
+            try:
+                r = self.session.get(self._base_url, params=params, verify=False, timeout=self.timeout)
+                r.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                logger.error(f"[{self.ip}] Failed to fetch payment diagnostics: {e}")
+                return None
+            self._payment_cache[self.ip] = (time.time(), r.content)
+            return r.content
+
     def get_loyalty_fep_status(self, loyalty_names=None):
         """Fetch loyalty FEP status from Verifone Commander API."""
-        token = self.get_token()
-        if not token:
-            return None
-
-        url = f"https://{self.ip}/cgi-bin/CGILink?cmd=vpaymentdiagnostics&cookie={token}"
-        try:
-            r = self.session.get(url, verify=False, timeout=self.timeout)
-            r.raise_for_status()
-            return self.parse_loyalty_fep_status(etree.fromstring(r.content), loyalty_names)
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[{self.ip}] Failed to fetch loyalty FEP status: {e}")
+        xml_data = self._get_payment_diagnostics()
+        if xml_data is None:
             return None
+        return self.parse_loyalty_fep_status(xml_data, loyalty_names)
 
     def get_primary_fep_status(self):
         """Fetch primary FEP status from Verifone Commander API."""
-        token = self.get_token()
-        if not token:
-            return None
-
-        url = f"https://{self.ip}/cgi-bin/CGILink?cmd=vpaymentdiagnostics&cookie={token}"
-        try:
-            r = self.session.get(url, verify=False, timeout=self.timeout)
-            r.raise_for_status()
-            return self.parse_primary_fep_status(etree.fromstring(r.content))
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[{self.ip}] Failed to fetch primary FEP status: {e}")
+        xml_data = self._get_payment_diagnostics()
+        if xml_data is None:
             return None
+        return self.parse_primary_fep_status(xml_data)
 
     def parse_diagnostics(self, xml_data):
-        """Parse XML response to extract device statuses."""
+        """Parse diagnostics XML bytes in a single streaming iterparse pass.
+
+        Handled subtrees are cleared as they complete, so peak memory is
+        bounded by one fueling point rather than the whole document.
+        """
         if xml_data is None:
             return None
 
-        logger.debug(etree.tostring(xml_data, pretty_print=True).decode())
-
-        ns = {'diag': 'urn:vfi-sapphire:diagnostics.2017-01-17'}
-        
-        # Controller status
-        controller_status_element = xml_data.find(".//controller")
-        controller_status = 1 if controller_status_element is not None and controller_status_element.get('status') == 'Online' else 0
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(xml_data.decode('utf-8', errors='replace'))
 
+        controller_status = 0
         pumps = []
         dcrs = []
-
-        for fueling_point in xml_data.findall(".//fuelingPoint"):
-            fp_id = fueling_point.get('sysid')
-            if not fp_id:
-                continue
-
-            # Pumps
-            pump_element = fueling_point.find(".//device[@type='Pump']")
-            if pump_element is not None:
-                pump_status = 1 if pump_element.get('status') == 'Online' and pump_element.get('isAvailable') == 'true' else 0
-                pumps.append({'id': fp_id, 'status': pump_status})
-
-            # DCRs
-            dcr_element = fueling_point.find(".//device[@type='DCR']")
-            if dcr_element is not None:
-                dcr_status = 1 if dcr_element.get('status') == 'Online' and dcr_element.get('isAvailable') == 'true' else 0
-                dcrs.append({'id': fp_id, 'status': dcr_status})
-        
-        # Fuel Price Displays
         price_displays = []
-        for device in xml_data.findall(".//device[@type='Fuel Price Display']"):
-            device_id = device.get('id')
-            if not device_id:
-                logger.warning("Fuel Price Display is missing an 'id' attribute, skipping.")
-                continue
-            status = 1 if device.get('status') == 'Online' and device.get('isAvailable') == 'true' else 0
-            price_displays.append({'id': device_id, 'status': status})
+
+        for _, element in etree.iterparse(BytesIO(xml_data), events=('end',),
+                                          tag=('controller', 'fuelingPoint', 'device')):
+            tag = element.tag
+            if tag == 'controller':
+                controller_status = 1 if element.get('status') == 'Online' else 0
+            elif tag == 'fuelingPoint':
+                fp_id = element.get('sysid')
+                if fp_id:
+                    # First Pump/DCR per fueling point, matching the old
+                    # find() semantics.
+                    fp_seen = set()
+                    for device in element.iter('device'):
+                        device_type = device.get('type')
+                        if device_type in ('Pump', 'DCR') and device_type not in fp_seen:
+                            fp_seen.add(device_type)
+                            status = 1 if device.get('status') == 'Online' and device.get('isAvailable') == 'true' else 0
+                            if device_type == 'Pump':
+                                pumps.append({'id': fp_id, 'status': status})
+                            else:
+                                dcrs.append({'id': fp_id, 'status': status})
+                # Drop the completed subtree and any already-handled siblings.
+                element.clear(keep_tail=True)
+                parent = element.getparent()
+                if parent is not None:
+                    while element.getprevious() is not None:
+                        del parent[0]
+            elif element.get('type') == 'Fuel Price Display':
+                device_id = element.get('id')
+                if not device_id:
+                    logger.warning("Fuel Price Display is missing an 'id' attribute, skipping.")
+                    continue
+                status = 1 if element.get('status') == 'Online' and element.get('isAvailable') == 'true' else 0
+                price_displays.append({'id': device_id, 'status': status})
 
         return {
             'controller_status': controller_status,
@@ -241,60 +380,94 @@ class VerifoneAPIClient:
         }
 
     def parse_loyalty_fep_status(self, xml_data, loyalty_names=None):
-        """Parse XML response to extract loyalty FEP connection status."""
+        """Parse payment-diagnostics XML bytes for loyalty FEP connection status.
+
+        Streams over fepDetail elements and stops at the first loyalty
+        match, so a hit near the top of the document never parses the rest.
+        """
         if xml_data is None:
             return None
 
         if loyalty_names is None:
             loyalty_names = ['rewards 2 go']  # Default fallback
 
-        logger.debug(etree.tostring(xml_data, pretty_print=True).decode())
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(xml_data.decode('utf-8', errors='replace'))
+
+        # Normalize once so the per-FEP check is a set lookup instead of a
+        # linear scan over loyalty_names.
+        loyalty_set = frozenset(name.casefold() for name in loyalty_names)
 
-        for fep in xml_data.findall(".//fepDetail"):
-            fep_name = fep.get('fepName', '').lower()
+        for _, fep in etree.iterparse(BytesIO(xml_data), events=('end',), tag='fepDetail'):
+            fep_name = fep.get('fepName', '').casefold()
             # Check if the FEP name matches any of the configured loyalty names
-            if any(name.lower() == fep_name for name in loyalty_names):
-                connection_status_text = fep.findtext("connectionStatus")
-                if connection_status_text is not None:
-                    connection_status = 1 if connection_status_text.lower() == 'true' else 0
+            if fep_name in loyalty_set:
+                # Presence check, not truthiness: an empty <connectionStatus/>
+                # is an explicit disconnect, only a missing child means no data
+                status_element = fep.find('connectionStatus')
+                if status_element is not None:
+                    connection_status = 1 if (status_element.text or '') in _TRUE else 0
                     return {"loyalty_status": connection_status}
+            fep.clear(keep_tail=True)
         return None
 
     def parse_primary_fep_status(self, xml_data):
-        """Parse XML response to extract primary FEP connection status."""
+        """Parse payment-diagnostics XML bytes for primary FEP connection status.
+
+        Streams over fepDetail elements and stops at the first primary FEP.
+        """
         if xml_data is None:
             return None
 
-        logger.debug(etree.tostring(xml_data, pretty_print=True).decode())
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(xml_data.decode('utf-8', errors='replace'))
 
-        for fep in xml_data.findall(".//fepDetail"):
-            if fep.get('isPrimary', 'false').lower() == 'true':
+        for _, fep in etree.iterparse(BytesIO(xml_data), events=('end',), tag='fepDetail'):
+            if fep.get('isPrimary', 'false') in _TRUE:
                 fep_name = fep.get('fepName', '')
-                connection_status_text = fep.findtext("connectionStatus")
-                if connection_status_text is not None:
-                    # Handle special cases where status might be "Undetermined"
-                    if connection_status_text.lower() == 'true':
-                        connection_status = 1
-                    elif connection_status_text.lower() == 'false':
-                        connection_status = 0
-                    else:
-                        # For "Undetermined" or other values, treat as disconnected
-                        connection_status = 0
+                # Presence check, not truthiness: an empty <connectionStatus/>
+                # is an explicit disconnect, only a missing child means no data
+                status_element = fep.find('connectionStatus')
+                if status_element is not None:
+                    # "Undetermined" or any other value is treated as disconnected
+                    connection_status = 1 if (status_element.text or '') in _TRUE else 0
                     return {
                         "primary_fep_name": fep_name,
                         "primary_fep_status": connection_status
                     }
+            fep.clear(keep_tail=True)
         return None
 
+    def collect_all(self, loyalty_names=None):
+        """Fetch all three diagnostic endpoints for this commander concurrently.
+
+        The endpoints are independent and share one cached token and the
+        pooled session, so firing them on three keep-alive sockets takes
+        max(RTT) instead of the sum. Opt-in: callers that only need a single
+        endpoint keep using the individual getters.
+        """
+        # Authenticate up front so the three workers all hit the token cache
+        # instead of racing on the single-flight lock.
+        if not self.get_token():
+            return {'diagnostics': None, 'primary_fep': None, 'loyalty_fep': None}
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = {
+                'diagnostics': executor.submit(self.get_forecourt_diagnostics),
+                'primary_fep': executor.submit(self.get_primary_fep_status),
+                'loyalty_fep': executor.submit(self.get_loyalty_fep_status, loyalty_names),
+            }
+            return {key: future.result() for key, future in futures.items()}
+
     def release_my_token(self):
         """Release this instance's cached token when no longer required."""
         self.release_token(self.cache_key)
 
     @classmethod
     def reset_failed_attempts(cls):
-        """Reset failed attempts counter for all IPs."""
-        cls._failed_attempts.clear()
-        logger.debug("Reset failed attempts counter for all commanders.")
+        """Reset failure/backoff state for all IPs."""
+        cls._failed_state.clear()
+        logger.debug("Reset failure state for all commanders.")
 
     @classmethod
     def clear_token_cache(cls):
@@ -2,9 +2,77 @@
 
 import os
 import csv
-from collections import defaultdict, Counter
+import io
+import pickle
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
 
+# Membership checks avoid allocating a lowercased copy of these fields for
+# every fepDetail element
+_TRUE = frozenset({'true', 'True', 'TRUE'})
+
+def _parse_fep_file(filepath):
+    """Parse one saved diagnostics file into its list of FEP entries.
+
+    Streams the file with iterparse and clears each fepDetail once read, so
+    large dumps never hold a full tree. Returns (feps, error); error is set
+    instead of raising so the callers' map() iteration keeps going.
+    """
+    feps = []
+    try:
+        for _, fep in etree.iterparse(filepath, events=('end',), tag='fepDetail'):
+            feps.append({
+                # Interned so the aggregation dict lookups hit cached hashes
+                'name': sys.intern(fep.get('fepName', '')),
+                'is_primary': fep.get('isPrimary', 'false') in _TRUE,
+                'connected': fep.findtext("connectionStatus", "") in _TRUE
+            })
+            fep.clear(keep_tail=True)
+    except Exception as e:
+        return None, e
+    return feps, None
+
+def _load_store_mapping(csv_path='commanders.csv'):
+    """Build the ip -> store info mapping, cached in a pickle sidecar.
+
+    Repeated analysis runs hit the pickle (keyed by the CSV's mtime) instead
+    of re-decoding the CSV each time.
+    """
+    cache_path = csv_path + '.cache.pkl'
+    try:
+        source_mtime = os.path.getmtime(csv_path)
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('mtime') == source_mtime:
+            return cached['data']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+
+    mapping = {}
+    with open(csv_path, 'r') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        ip_idx = header.index('ip')
+        store_idx = header.index('store')
+        brand_idx = header.index('brand')
+        group_idx = header.index('group')
+        for row in reader:
+            mapping[row[ip_idx]] = {
+                'store': row[store_idx],
+                'brand': row[brand_idx],
+                'group': row[group_idx]
+            }
+
+    try:
+        with open(cache_path, 'wb') as f:
+            pickle.dump({'mtime': source_mtime, 'data': mapping}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        # Cache is an optimization; a read-only directory shouldn't break analysis
+        pass
+    return mapping
+
 def analyze_fep_patterns():
     """Analyze FEP connection patterns across all collected XML files."""
 
@@ -14,138 +82,124 @@ def analyze_fep_patterns():
         return
 
     # Load store mapping for context
-    store_mapping = {}
-    with open('commanders.csv', 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            store_mapping[row['ip']] = {
-                'store': row['store'],
-                'brand': row['brand'],
-                'group': row['group']
-            }
+    store_mapping = _load_store_mapping()
 
     fep_by_store = {}
-    fep_counts = Counter()
-    brand_fep_mapping = defaultdict(set)
-    primary_feps = Counter()
-    connection_status_summary = defaultdict(list)
-
-    # Process all XML files
-    for filename in os.listdir(xml_dir):
-        if not filename.endswith('.xml'):
-            continue
-
-        filepath = os.path.join(xml_dir, filename)
-
-        # Extract IP from filename
-        ip = filename.split('_')[-1].replace('.xml', '')
-        store_info = store_mapping.get(ip, {'store': 'Unknown', 'brand': 'Unknown', 'group': 'Unknown'})
-
-        try:
-            with open(filepath, 'rb') as f:
-                xml_content = f.read()
-
-            parsed_xml = etree.fromstring(xml_content)
-
-            store_feps = []
-            for fep in parsed_xml.findall(".//fepDetail"):
-                fep_name = fep.get('fepName', '')
-                is_primary = fep.get('isPrimary', 'false').lower() == 'true'
-                connection_status = fep.findtext("connectionStatus", "").lower() == 'true'
-
-                store_feps.append({
-                    'name': fep_name,
-                    'is_primary': is_primary,
-                    'connected': connection_status
-                })
-
-                # Count occurrences
-                fep_counts[fep_name] += 1
-                brand_fep_mapping[store_info['brand']].add(fep_name)
-
-                if is_primary:
-                    primary_feps[fep_name] += 1
-
-                # Track connection status
-                connection_status_summary[fep_name].append(connection_status)
+    # One record per FEP name: [count, primary_count, connected_count,
+    # total_count, brands]. A single lookup per fepDetail replaces the four
+    # separate counter structures.
+    stats = {}
+
+    # Collect the dump files up front, then parse them in parallel; the
+    # aggregation below stays on the main thread.
+    with os.scandir(xml_dir) as entries:
+        xml_files = sorted(entry.path for entry in entries
+                           if entry.is_file() and entry.name.endswith('.xml'))
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor:
+        results = zip(xml_files, executor.map(_parse_fep_file, xml_files))
+        for filepath, (store_feps, error) in results:
+            filename = os.path.basename(filepath)
+            if error is not None:
+                print(f"Error processing {filename}: {error}")
+                continue
+
+            # Extract IP from filename
+            ip = filename.split('_')[-1].replace('.xml', '')
+            store_info = store_mapping.get(ip, {'store': 'Unknown', 'brand': 'Unknown', 'group': 'Unknown'})
+
+            for fep in store_feps:
+                rec = stats.get(fep['name'])
+                if rec is None:
+                    rec = stats[fep['name']] = [0, 0, 0, 0, set()]
+                rec[0] += 1
+                rec[1] += fep['is_primary']
+                rec[2] += fep['connected']
+                rec[3] += 1
+                rec[4].add(store_info['brand'])
 
             fep_by_store[f"{store_info['store']} ({store_info['brand']})"] = store_feps
 
-        except Exception as e:
-            print(f"Error processing {filename}: {e}")
+    # Build the report in one buffer and write it with a single syscall;
+    # per-line print() flushes dominate when stdout is a pipe.
+    buf = io.StringIO()
+    echo = buf.write
 
-    # Print analysis results
-    print("=" * 80)
-    print("FEP CONNECTION ANALYSIS ACROSS COMMANDERS")
-    print("=" * 80)
+    echo("=" * 80 + '\n')
+    echo("FEP CONNECTION ANALYSIS ACROSS COMMANDERS\n")
+    echo("=" * 80 + '\n')
 
-    print(f"\nTotal stores analyzed: {len(fep_by_store)}")
-    print(f"Unique FEP types found: {len(fep_counts)}")
+    echo(f"\nTotal stores analyzed: {len(fep_by_store)}\n")
+    echo(f"Unique FEP types found: {len(stats)}\n")
 
-    print("\n" + "=" * 50)
-    print("FEP FREQUENCY ANALYSIS")
-    print("=" * 50)
+    echo('\n' + '=' * 50 + '\n')
+    echo("FEP FREQUENCY ANALYSIS\n")
+    echo("=" * 50 + '\n')
 
-    print("\nFEP occurrences across all stores:")
-    for fep_name, count in fep_counts.most_common():
-        connected_count = sum(1 for status in connection_status_summary[fep_name] if status)
-        total_count = len(connection_status_summary[fep_name])
+    echo("\nFEP occurrences across all stores:\n")
+    for fep_name, rec in sorted(stats.items(), key=lambda kv: -kv[1][0]):
+        count, _, connected_count, total_count, _ = rec
         connection_rate = (connected_count / total_count * 100) if total_count > 0 else 0
 
-        print(f"  {fep_name:<25} : {count:>2} stores ({connection_rate:>5.1f}% connected)")
+        echo(f"  {fep_name:<25} : {count:>2} stores ({connection_rate:>5.1f}% connected)\n")
+
+    echo('\n' + '=' * 50 + '\n')
+    echo("PRIMARY FEP ANALYSIS\n")
+    echo("=" * 50 + '\n')
 
-    print("\n" + "=" * 50)
-    print("PRIMARY FEP ANALYSIS")
-    print("=" * 50)
+    echo("\nFEPs configured as PRIMARY:\n")
+    primary_entries = [(name, rec[1]) for name, rec in stats.items() if rec[1] > 0]
+    for fep_name, count in sorted(primary_entries, key=lambda kv: -kv[1]):
+        echo(f"  {fep_name:<25} : {count} stores\n")
 
-    print("\nFEPs configured as PRIMARY:")
-    for fep_name, count in primary_feps.most_common():
-        print(f"  {fep_name:<25} : {count} stores")
+    echo('\n' + '=' * 50 + '\n')
+    echo("BRAND-SPECIFIC FEP MAPPING\n")
+    echo("=" * 50 + '\n')
 
-    print("\n" + "=" * 50)
-    print("BRAND-SPECIFIC FEP MAPPING")
-    print("=" * 50)
+    # Invert the per-FEP brand sets into the brand -> FEPs view
+    brand_fep_mapping = {}
+    for fep_name, rec in stats.items():
+        for brand in rec[4]:
+            brand_fep_mapping.setdefault(brand, []).append(fep_name)
 
     for brand in sorted(brand_fep_mapping.keys()):
-        feps = sorted(brand_fep_mapping[brand])
-        print(f"\n{brand}:")
-        for fep in feps:
-            primary_count = primary_feps.get(fep, 0)
-            total_count = fep_counts.get(fep, 0)
-            primary_indicator = " (PRIMARY)" if primary_count > 0 else ""
-            print(f"  - {fep}{primary_indicator}")
+        echo(f"\n{brand}:\n")
+        for fep in sorted(brand_fep_mapping[brand]):
+            primary_indicator = " (PRIMARY)" if stats[fep][1] > 0 else ""
+            echo(f"  - {fep}{primary_indicator}\n")
 
-    print("\n" + "=" * 50)
-    print("RECOMMENDED GLOBAL FEP METRICS")
-    print("=" * 50)
+    echo('\n' + '=' * 50 + '\n')
+    echo("RECOMMENDED GLOBAL FEP METRICS\n")
+    echo("=" * 50 + '\n')
 
     # Identify common FEPs worth tracking globally
     common_threshold = 3  # FEPs that appear in 3+ stores
-    common_feps = [fep for fep, count in fep_counts.items() if count >= common_threshold]
+    common_feps = [fep for fep, rec in stats.items() if rec[0] >= common_threshold]
 
-    print(f"\nFEPs appearing in {common_threshold}+ stores (recommended for global monitoring):")
+    echo(f"\nFEPs appearing in {common_threshold}+ stores (recommended for global monitoring):\n")
     for fep in sorted(common_feps):
-        count = fep_counts[fep]
-        is_primary = fep in primary_feps
-        primary_note = " [Often PRIMARY]" if is_primary else " [Secondary]"
-        print(f"  - {fep} ({count} stores){primary_note}")
+        count = stats[fep][0]
+        primary_note = " [Often PRIMARY]" if stats[fep][1] > 0 else " [Secondary]"
+        echo(f"  - {fep} ({count} stores){primary_note}\n")
 
-    print("\nFEPs appearing in <3 stores (brand/location specific):")
-    rare_feps = [fep for fep, count in fep_counts.items() if count < common_threshold]
+    echo("\nFEPs appearing in <3 stores (brand/location specific):\n")
+    rare_feps = [fep for fep, rec in stats.items() if rec[0] < common_threshold]
     for fep in sorted(rare_feps):
-        count = fep_counts[fep]
-        print(f"  - {fep} ({count} store{'s' if count > 1 else ''})")
+        count = stats[fep][0]
+        echo(f"  - {fep} ({count} store{'s' if count > 1 else ''})\n")
 
-    print("\n" + "=" * 50)
-    print("DETAILED STORE BREAKDOWN")
-    print("=" * 50)
+    echo('\n' + '=' * 50 + '\n')
+    echo("DETAILED STORE BREAKDOWN\n")
+    echo("=" * 50 + '\n')
 
     for store, feps in sorted(fep_by_store.items()):
-        print(f"\n{store}:")
+        echo(f"\n{store}:\n")
         for fep in feps:
             status = "CONNECTED" if fep['connected'] else "DISCONNECTED"
             primary = "PRIMARY" if fep['is_primary'] else "SECONDARY"
-            print(f"  - {fep['name']:<25} : {primary:<9} | {status}")
+            echo(f"  - {fep['name']:<25} : {primary:<9} | {status}\n")
+
+    sys.stdout.write(buf.getvalue())
 
 if __name__ == "__main__":
     analyze_fep_patterns()
\ No newline at end of file
@@ -5,15 +5,35 @@ import yaml
 import csv
 import sys
 import os
+import shutil
 from lxml import etree
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import urllib3
 import argparse
+import atexit
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
 
 # Suppress SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+@functools.lru_cache(maxsize=1)
+def _get_session():
+    """Process-wide requests session with retries and a sized pool.
+
+    Built once so repeated analyzer instantiations (or future callers in the
+    same process) share keep-alive sockets and the TLS handshake cost.
+    """
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=32, pool_maxsize=64)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    atexit.register(session.close)
+    return session
+
 class CommanderAnalyzer:
     def __init__(self, credentials_file, commanders_file):
         with open(credentials_file, 'r') as f:
@@ -21,12 +41,13 @@ class CommanderAnalyzer:
             self.username = creds['credentials']['username']
             self.password = creds['credentials']['password']
 
-        # Setup session with retry strategy
-        self.session = requests.Session()
-        retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-        adapter = HTTPAdapter(max_retries=retries)
-        self.session.mount('https://', adapter)
-        self.session.mount('http://', adapter)
+        # Shared module-level session; pool sizes are raised above the
+        # urllib3 defaults so concurrent workers keep their keep-alive
+        # sockets instead of discarding connections.
+        self.session = _get_session()
+
+        # Keeps multi-line console output readable under parallel workers
+        self._print_lock = Lock()
 
         # Load commander list
         self.commanders = []
@@ -48,65 +69,104 @@ class CommanderAnalyzer:
             print(f"Failed to get token for {ip}: {e}")
             return None
 
-    def get_vpayment_xml(self, ip, token, timeout=15):
-        """Get raw XML from vpaymentdiagnostics API."""
+    def _stream_vpayment_xml(self, ip, token, filename, timeout=15):
+        """Stream the vpaymentdiagnostics response straight into a file.
+
+        Copies from the raw socket in 64KB chunks, so peak memory stays at
+        one chunk buffer instead of the whole XML body. Returns True on
+        success.
+        """
         url = f"https://{ip}/cgi-bin/CGILink?cmd=vpaymentdiagnostics&cookie={token}"
         try:
-            r = self.session.get(url, verify=False, timeout=timeout)
-            r.raise_for_status()
-            return r.content
+            with self.session.get(url, stream=True, verify=False, timeout=timeout) as r:
+                r.raise_for_status()
+                # Stream-decompress gzip-encoded responses as they arrive
+                r.raw.decode_content = True
+                with open(filename, 'wb') as fh:
+                    shutil.copyfileobj(r.raw, fh, length=64 * 1024)
+            return True
         except Exception as e:
             print(f"Failed to get vpayment XML for {ip}: {e}")
-            return None
+            return False
 
-    def analyze_commanders(self, max_commanders=5, output_dir="vpayment_xml_dumps"):
-        """Query multiple commanders and save raw XML responses."""
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        successful_queries = 0
-
-        for commander in self.commanders[:max_commanders]:
-            ip = commander['ip']
-            store = commander['store']
+    def _preview_xml(self, filename, limit=2000):
+        """Build an indented preview of a saved XML file.
 
-            print(f"\n=== Analyzing {store} ({ip}) ===")
-
-            # Get token
-            token = self.get_token(ip)
-            if not token:
+        Walks the file with iterparse and stops once the preview budget is
+        spent, so the full tree is never materialized just to show its head.
+        """
+        parts = []
+        size = 0
+        depth = 0
+        try:
+            for event, element in etree.iterparse(filename, events=('start', 'end')):
+                if event == 'start':
+                    attrs = ''.join(f' {key}="{value}"' for key, value in element.attrib.items())
+                    text = (element.text or '').strip()
+                    line = f"{'  ' * depth}<{element.tag}{attrs}>{text}"
+                    parts.append(line)
+                    size += len(line) + 1
+                    depth += 1
+                    if size >= limit:
+                        parts.append(f"... (truncated, full content in {filename})")
+                        break
+                else:
+                    depth -= 1
+                    element.clear(keep_tail=True)
+        except etree.XMLSyntaxError as e:
+            parts.append(f"Could not parse XML: {e}")
+        return '\n'.join(parts)
+
+    def _process_one(self, commander, output_dir, preview=False):
+        """Fetch, save, and optionally preview one commander. Returns True on success."""
+        ip = commander['ip']
+        store = commander['store']
+
+        # Get token
+        token = self.get_token(ip)
+        if not token:
+            with self._print_lock:
+                print(f"\n=== Analyzing {store} ({ip}) ===")
                 print(f"Could not authenticate to {store}")
-                continue
+            return False
 
-            # Get XML
-            xml_content = self.get_vpayment_xml(ip, token)
-            if not xml_content:
+        # Stream XML straight to the output file
+        filename = f"{output_dir}/{store.replace(' ', '_')}_{ip}.xml"
+        if not self._stream_vpayment_xml(ip, token, filename):
+            with self._print_lock:
+                print(f"\n=== Analyzing {store} ({ip}) ===")
                 print(f"Could not retrieve XML from {store}")
-                continue
-
-            # Save raw XML to file
-            filename = f"{output_dir}/{store.replace(' ', '_')}_{ip}.xml"
-            with open(filename, 'wb') as f:
-                f.write(xml_content)
+            return False
 
+        # Preview is opt-in: rendering it walks the XML again, which is
+        # wasted work when the files are only collected for later analysis.
+        preview_text = self._preview_xml(filename) if preview else None
+        with self._print_lock:
+            print(f"\n=== Analyzing {store} ({ip}) ===")
             print(f"Saved raw XML to: {filename}")
-
-            # Also pretty print to console for immediate analysis
-            try:
-                parsed_xml = etree.fromstring(xml_content)
-                pretty_xml = etree.tostring(parsed_xml, pretty_print=True, encoding='unicode')
-                print(f"Raw XML content preview (first 2000 chars):")
+            if preview_text is not None:
+                print(f"XML content preview (first 2000 chars):")
                 print("-" * 50)
-                print(pretty_xml[:2000])
-                if len(pretty_xml) > 2000:
-                    print(f"... (truncated, full content in {filename})")
+                print(preview_text)
                 print("-" * 50)
-            except Exception as e:
-                print(f"Could not parse XML: {e}")
-                print("Raw content:")
-                print(xml_content.decode('utf-8', errors='ignore')[:1000])
 
-            successful_queries += 1
+        return True
+
+    def analyze_commanders(self, max_commanders=5, output_dir="vpayment_xml_dumps", preview=False):
+        """Query multiple commanders in parallel and save raw XML responses."""
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        successful_queries = 0
+        targets = self.commanders[:max_commanders]
+
+        # The work is network-bound (auth + diagnostics round trips per
+        # commander), so overlap the commanders on the pooled session.
+        with ThreadPoolExecutor(max_workers=min(16, max(1, len(targets)))) as executor:
+            futures = [executor.submit(self._process_one, commander, output_dir, preview) for commander in targets]
+            for future in as_completed(futures):
+                if future.result():
+                    successful_queries += 1
 
         print(f"\nSuccessfully queried {successful_queries} commanders")
         if successful_queries > 0:
@@ -118,6 +178,8 @@ def main():
                        help='Maximum number of commanders to query (default: 5)')
     parser.add_argument('--output-dir', '-o', default='vpayment_xml_dumps',
                        help='Output directory for XML files (default: vpayment_xml_dumps)')
+    parser.add_argument('--preview', action='store_true',
+                       help='Pretty-print a preview of each XML response to the console')
 
     args = parser.parse_args()
 
@@ -131,7 +193,8 @@ def main():
         sys.exit(1)
 
     analyzer = CommanderAnalyzer('credentials.yaml', 'commanders.csv')
-    analyzer.analyze_commanders(max_commanders=args.max_commanders, output_dir=args.output_dir)
+    analyzer.analyze_commanders(max_commanders=args.max_commanders, output_dir=args.output_dir,
+                                preview=args.preview)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
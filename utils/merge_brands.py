@@ -5,7 +5,9 @@ Creates a new commanders.csv with brand information.
 """
 
 import csv
+import os
 import sys
+from collections import Counter
 
 def load_brands():
     """Load brand mappings from brands.csv"""
@@ -26,48 +28,39 @@ def load_brands():
 def merge_commanders_brands():
     """Merge commanders.csv with brand data"""
     brands = load_brands()
-    
-    # Read existing commanders
-    commanders = []
+
+    # Stream rows from commanders.csv into a temp file, tallying brands as
+    # we go; the whole commander list is never held in memory.
+    merged = 0
+    brand_counts = Counter()
+    tmp_path = 'commanders.csv.tmp'
     try:
-        with open('commanders.csv', 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            commanders = list(reader)
+        with open('commanders.csv', 'r', encoding='utf-8', newline='') as src, \
+             open(tmp_path, 'w', encoding='utf-8', newline='') as dst:
+            reader = csv.reader(src)
+            writer = csv.writer(dst)
+            header = next(reader)
+            ip_idx = header.index('ip')
+            store_idx = header.index('store')
+            group_idx = header.index('group')
+            enabled_idx = header.index('enabled')
+
+            writer.writerow(['ip', 'store', 'group', 'brand', 'enabled'])
+            for row in reader:
+                store_name = row[store_idx]
+                brand = brands.get(store_name, 'Unknown')
+                writer.writerow((row[ip_idx], store_name, row[group_idx], brand, row[enabled_idx]))
+                merged += 1
+                brand_counts[brand] += 1
     except FileNotFoundError:
         print("Error: commanders.csv not found")
         sys.exit(1)
-    
-    # Add brand column to each commander
-    updated_commanders = []
-    for commander in commanders:
-        store_name = commander['store']
-        brand = brands.get(store_name, 'Unknown')
-        
-        # Create new row with brand
-        updated_commander = {
-            'ip': commander['ip'],
-            'store': commander['store'], 
-            'group': commander['group'],
-            'brand': brand,
-            'enabled': commander['enabled']
-        }
-        updated_commanders.append(updated_commander)
-    
-    # Write updated commanders.csv
-    with open('commanders.csv', 'w', newline='', encoding='utf-8') as f:
-        fieldnames = ['ip', 'store', 'group', 'brand', 'enabled']
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(updated_commanders)
-    
-    print(f"Successfully merged {len(updated_commanders)} commanders with brand data")
-    
-    # Show brand distribution
-    brand_counts = {}
-    for commander in updated_commanders:
-        brand = commander['brand']
-        brand_counts[brand] = brand_counts.get(brand, 0) + 1
-    
+
+    # Atomic swap so a crash mid-write can't truncate commanders.csv
+    os.replace(tmp_path, 'commanders.csv')
+
+    print(f"Successfully merged {merged} commanders with brand data")
+
     print("\nBrand distribution:")
     for brand, count in sorted(brand_counts.items()):
         print(f"  {brand}: {count} stores")
@@ -3,17 +3,45 @@
 import requests
 import yaml
 import csv
+import io
 import sys
 import os
 from lxml import etree
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import urllib3
-from collections import defaultdict
+import random
+from urllib.parse import quote
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 # Suppress SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Parser and XPath objects are built once; recover=True tolerates the odd
+# malformed response a commander sends mid-restart
+_PARSER = etree.XMLParser(huge_tree=False, recover=True, remove_blank_text=True, resolve_entities=False)
+_COOKIE_XPATH = etree.XPath("string(.//cookie)")
+
+# Lightweight per-FEP record; a namedtuple is a third the size of the dict
+# it replaces and downstream access is by fixed field anyway
+FepInfo = namedtuple('FepInfo', 'name is_primary connected')
+
+class JitteredRetry(Retry):
+    """Retry policy with jittered exponential backoff, capped at 8s.
+
+    The stock Retry schedule is deterministic, so parallel workers retrying
+    against one struggling commander would all fire again in lockstep.
+    """
+    BACKOFF_CAP = 8.0
+
+    def get_backoff_time(self):
+        consecutive = len(self.history or ())
+        if consecutive <= 1:
+            return 0.0
+        base = self.backoff_factor * (2 ** (consecutive - 2))
+        return min(self.BACKOFF_CAP, base * (1 + random.random() * 0.5))
+
 class BrandAnalyzer:
     def __init__(self, credentials_file, commanders_file):
         with open(credentials_file, 'r') as f:
@@ -23,58 +51,131 @@ class BrandAnalyzer:
 
         # Setup session
         self.session = requests.Session()
-        retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-        adapter = HTTPAdapter(max_retries=retries)
+        retries = JitteredRetry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504],
+                                allowed_methods=frozenset(['GET']),
+                                respect_retry_after_header=True)
+        # Pool sized to the fan-out worker count; the urllib3 default of 10
+        # would discard connections and re-handshake under 32 workers
+        adapter = HTTPAdapter(max_retries=retries, pool_connections=64, pool_maxsize=64, pool_block=False)
         self.session.mount('https://', adapter)
         self.session.mount('http://', adapter)
-
-        # Load commanders grouped by brand
+        self.session.headers['Connection'] = 'keep-alive'
+        # Diagnostic XML is highly repetitive; compressed transfer trades a
+        # little CPU for a much smaller body (decoded transparently)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        # Credentials are quoted once here; per-store calls only fill in the
+        # IP. Also keeps '&' or spaces in a password from breaking the URL.
+        self._validate_url_tmpl = ("https://{ip}/cgi-bin/CGILink?cmd=validate"
+                                   f"&user={quote(self.username)}&passwd={quote(self.password)}")
+
+        # Load commanders grouped by brand; csv.reader with fixed column
+        # indices skips the per-row dict DictReader would build, and only
+        # the three fields _poll_store needs are kept
         self.commanders_by_brand = defaultdict(list)
         with open(commanders_file, 'r') as f:
-            reader = csv.DictReader(f)
+            reader = csv.reader(f)
+            header = next(reader)
+            i_ip = header.index('ip')
+            i_store = header.index('store')
+            i_brand = header.index('brand')
+            i_enabled = header.index('enabled')
             for row in reader:
-                if row['enabled'].lower() == 'true':
-                    self.commanders_by_brand[row['brand']].append(row)
+                if row[i_enabled].lower() == 'true':
+                    brand = row[i_brand]
+                    self.commanders_by_brand[brand].append(
+                        {'ip': row[i_ip], 'store': row[i_store], 'brand': brand})
 
-    def get_token(self, ip, timeout=5):
+    def get_token(self, ip, timeout=(3, 5)):
         """Get authentication token."""
-        url = f"https://{ip}/cgi-bin/CGILink?cmd=validate&user={self.username}&passwd={self.password}"
+        url = self._validate_url_tmpl.format(ip=ip)
         try:
             r = self.session.get(url, verify=False, timeout=timeout)
             r.raise_for_status()
-            token = etree.fromstring(r.content).findtext(".//cookie")
-            return token
+            return _COOKIE_XPATH(etree.fromstring(r.content, _PARSER)) or None
         except Exception as e:
             print(f"Failed to get token for {ip}: {e}")
             return None
 
-    def get_vpayment_xml(self, ip, token, timeout=8):
-        """Get vpayment diagnostics XML."""
+    def get_vpayment_xml(self, ip, token, timeout=(3, 8)):
+        """Open a streamed vpayment diagnostics response.
+
+        Returns the raw urllib3 stream (gzip transparently decoded) so the
+        caller can parse incrementally while the body is still arriving.
+        """
         url = f"https://{ip}/cgi-bin/CGILink?cmd=vpaymentdiagnostics&cookie={token}"
         try:
-            r = self.session.get(url, verify=False, timeout=timeout)
+            r = self.session.get(url, stream=True, verify=False, timeout=timeout)
             r.raise_for_status()
-            return r.content
+            r.raw.decode_content = True
+            return r.raw
         except Exception as e:
             print(f"Failed to get vpayment XML for {ip}: {e}")
             return None
 
-    def extract_feps(self, xml_content):
-        """Extract FEP information from XML."""
+    def extract_feps(self, xml_stream):
+        """Extract FEP information from a streamed XML response.
+
+        iterparse consumes the stream as it arrives and each fepDetail is
+        cleared once read, so peak memory stays constant regardless of how
+        much diagnostics XML the commander returns.
+        """
         try:
-            parsed_xml = etree.fromstring(xml_content)
             feps = []
-            for fep in parsed_xml.findall(".//fepDetail"):
-                fep_info = {
-                    'name': fep.get('fepName', ''),
-                    'is_primary': fep.get('isPrimary', 'false').lower() == 'true',
-                    'connected': fep.findtext("connectionStatus", "").lower() == 'true'
-                }
-                feps.append(fep_info)
+            for _, fep in etree.iterparse(xml_stream, events=('end',), tag='fepDetail'):
+                feps.append(FepInfo(
+                    fep.get('fepName', ''),
+                    fep.get('isPrimary', 'false').lower() == 'true',
+                    fep.findtext("connectionStatus", "").lower() == 'true'
+                ))
+                fep.clear(keep_tail=True)
+                parent = fep.getparent()
+                if parent is not None:
+                    while fep.getprevious() is not None:
+                        del parent[0]
             return feps
         except Exception as e:
             print(f"Error parsing XML: {e}")
             return []
+        finally:
+            xml_stream.close()
+
+    def _poll_store(self, store):
+        """Query one store and return (brand, store_name, feps, log).
+
+        feps is None when the store could not be queried. The store's
+        console block comes back as one string so the main thread can write
+        it with a single call — workers never contend on stdout.
+        """
+        ip = store['ip']
+        store_name = store['store']
+        brand = store['brand']
+
+        buf = io.StringIO()
+        print(f"\nQuerying {store_name} ({ip})...", file=buf)
+
+        # Get token and XML
+        token = self.get_token(ip)
+        if not token:
+            print(f"  ❌ Authentication failed", file=buf)
+            return brand, store_name, None, buf.getvalue()
+
+        xml_content = self.get_vpayment_xml(ip, token)
+        if not xml_content:
+            print(f"  ❌ Failed to get payment diagnostics", file=buf)
+            return brand, store_name, None, buf.getvalue()
+
+        # Extract FEPs
+        feps = self.extract_feps(xml_content)
+        if not feps:
+            print(f"  ❌ No FEPs found", file=buf)
+        else:
+            print(f"  ✅ Found {len(feps)} FEPs:", file=buf)
+            for fep in feps:
+                status = "🟢 CONNECTED" if fep.connected else "🔴 DISCONNECTED"
+                role = "PRIMARY" if fep.is_primary else "SECONDARY"
+                print(f"    - {fep.name:<25} [{role:<9}] {status}", file=buf)
+        return brand, store_name, feps or None, buf.getvalue()
 
     def analyze_by_brand(self, max_per_brand=1):
         """Query commanders from each brand to identify FEP patterns."""
@@ -83,64 +184,44 @@ class BrandAnalyzer:
         print("PRIMARY PAYMENT PROCESSOR ANALYSIS BY FUEL BRAND")
         print("=" * 80)
 
-        brand_fep_summary = {}
-
+        # Flatten the per-brand selections into one work list; each store is
+        # two HTTPS round trips, so the run is latency-bound and fans out
+        # well across threads on the pooled session.
+        worklist = []
+        stores_queried = {}
         for brand, stores in self.commanders_by_brand.items():
-            if not stores:
-                continue
-
-            print(f"\n{'='*20} {brand.upper()} BRAND {'='*20}")
-
-            brand_primary_feps = []
-            brand_all_feps = []
-
-            # Query up to max_per_brand stores from this brand
             stores_to_query = stores[:max_per_brand]
+            worklist.extend(stores_to_query)
+            stores_queried[brand] = len(stores_to_query)
+
+        # Accumulate straight into per-brand sets; no intermediate lists
+        brand_primary = defaultdict(set)
+        brand_all = defaultdict(set)
+        with ThreadPoolExecutor(max_workers=min(32, max(1, len(worklist)))) as executor:
+            for brand, store_name, feps, log in executor.map(self._poll_store, worklist):
+                sys.stdout.write(log)
+                for fep in feps or ():
+                    brand_all[brand].add(fep.name)
+                    if fep.is_primary:
+                        brand_primary[brand].add(fep.name)
+
+        # Summarize per brand once all stores have reported
+        brand_fep_summary = {}
+        for brand, queried in stores_queried.items():
+            if not queried:
+                continue
 
-            for store in stores_to_query:
-                ip = store['ip']
-                store_name = store['store']
-
-                print(f"\nQuerying {store_name} ({ip})...")
-
-                # Get token and XML
-                token = self.get_token(ip)
-                if not token:
-                    print(f"  ❌ Authentication failed")
-                    continue
-
-                xml_content = self.get_vpayment_xml(ip, token)
-                if not xml_content:
-                    print(f"  ❌ Failed to get payment diagnostics")
-                    continue
-
-                # Extract FEPs
-                feps = self.extract_feps(xml_content)
-                if not feps:
-                    print(f"  ❌ No FEPs found")
-                    continue
-
-                print(f"  ✅ Found {len(feps)} FEPs:")
-                for fep in feps:
-                    status = "🟢 CONNECTED" if fep['connected'] else "🔴 DISCONNECTED"
-                    role = "PRIMARY" if fep['is_primary'] else "SECONDARY"
-                    print(f"    - {fep['name']:<25} [{role:<9}] {status}")
-
-                    brand_all_feps.append(fep['name'])
-                    if fep['is_primary']:
-                        brand_primary_feps.append(fep['name'])
-
-            # Summarize for this brand
-            unique_primaries = list(set(brand_primary_feps))
-            unique_all = list(set(brand_all_feps))
+            unique_primaries = list(brand_primary[brand])
+            unique_all = list(brand_all[brand])
 
             brand_fep_summary[brand] = {
                 'primary_feps': unique_primaries,
                 'all_feps': unique_all,
-                'stores_queried': len(stores_to_query)
+                'stores_queried': queried
             }
 
-            print(f"\n{brand} SUMMARY:")
+            print(f"\n{'='*20} {brand.upper()} BRAND {'='*20}")
+            print(f"{brand} SUMMARY:")
             print(f"  Primary FEPs: {', '.join(unique_primaries) if unique_primaries else 'None found'}")
             print(f"  All FEPs: {', '.join(unique_all)}")
 
@@ -149,23 +230,29 @@ class BrandAnalyzer:
         print("OVERALL BRAND-TO-PRIMARY-FEP MAPPING")
         print("="*80)
 
-        all_primary_feps = set()
+        # Inverted index built in the same pass as the per-brand lines, so
+        # the unique-FEP report below is a lookup instead of a brand scan
+        fep_to_brands = defaultdict(list)
 
         for brand, info in brand_fep_summary.items():
             primaries = info['primary_feps']
-            all_primary_feps.update(primaries)
+            for fep in primaries:
+                fep_to_brands[fep].append(brand)
 
             primary_str = ', '.join(primaries) if primaries else 'No primary FEP found'
             print(f"{brand:<15} : {primary_str}")
 
         print(f"\n📊 UNIQUE PRIMARY FEPS ACROSS ALL BRANDS:")
-        for fep in sorted(all_primary_feps):
-            brands_using = [brand for brand, info in brand_fep_summary.items() if fep in info['primary_feps']]
-            print(f"  - {fep:<25} (Used by: {', '.join(brands_using)})")
+        for fep in sorted(fep_to_brands):
+            print(f"  - {fep:<25} (Used by: {', '.join(fep_to_brands[fep])})")
 
         return brand_fep_summary
 
 def main():
+    # Batch writes from the poll loop shouldn't be re-split line by line
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=False)
+
     if not os.path.exists('credentials.yaml'):
         print("Error: credentials.yaml not found")
         sys.exit(1)
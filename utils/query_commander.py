@@ -1,18 +1,37 @@
+import functools
 import requests
 import yaml
 from lxml import etree
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import urllib3
 import logging
 
 # Suppress InsecureRequestWarning
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Module-level session so the TLS handshake from get_token is reused by the
+# API query that follows it
+session = requests.Session()
+_retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
+_adapter = HTTPAdapter(max_retries=_retries, pool_connections=64, pool_maxsize=64, pool_block=False)
+session.mount('https://', _adapter)
+session.mount('http://', _adapter)
+session.headers['Connection'] = 'keep-alive'
+session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+# Built once: tuned parser for the small validate response and a compiled
+# cookie lookup, instead of re-interpreting the ElementPath per call
+_PARSER = etree.XMLParser(huge_tree=False, remove_blank_text=True, resolve_entities=False)
+_COOKIE_XPATH = etree.XPath("string(.//cookie)")
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=1)
 def load_credentials(file_path='credentials.yaml'):
-    """Loads credentials from a YAML file."""
+    """Loads credentials from a YAML file. Parsed once per process."""
     try:
         with open(file_path, 'r') as f:
             credentials = yaml.safe_load(f)
@@ -21,14 +40,18 @@ def load_credentials(file_path='credentials.yaml'):
         logger.error(f"Error loading credentials from {file_path}: {e}")
         return None, None
 
-def get_token(ip, username, password, timeout=30):
-    """Authenticate and retrieve session token."""
+def get_token(ip, username, password, timeout=(3, 10)):
+    """Authenticate and retrieve session token.
+
+    timeout is a (connect, read) tuple so a dead commander fails fast on
+    connect instead of tying a caller up for the full read window.
+    """
     logger.info(f"[{ip}] Attempting to authenticate...")
     url = f"https://{ip}/cgi-bin/CGILink?cmd=validate&user={username}&passwd={password}"
     try:
-        r = requests.get(url, verify=False, timeout=timeout)
+        r = session.get(url, verify=False, timeout=timeout)
         r.raise_for_status()
-        token = etree.fromstring(r.content).findtext(".//cookie")
+        token = _COOKIE_XPATH(etree.fromstring(r.content, _PARSER))
         if not token:
             logger.error(f"[{ip}] No token found in response. Authentication failed.")
             return None
@@ -38,12 +61,12 @@ def get_token(ip, username, password, timeout=30):
         logger.error(f"[{ip}] Failed to get token: {e}")
         return None
 
-def query_api(ip, token, api_command, timeout=30):
+def query_api(ip, token, api_command, timeout=(3, 10)):
     """Query the specified API command."""
     logger.info(f"[{ip}] Querying API command: {api_command}")
     url = f"https://{ip}/cgi-bin/CGILink?cmd={api_command}&cookie={token}"
     try:
-        r = requests.get(url, verify=False, timeout=timeout)
+        r = session.get(url, verify=False, timeout=timeout)
         r.raise_for_status()
         return r.content
     except requests.exceptions.RequestException as e:
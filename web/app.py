@@ -2,9 +2,17 @@ from flask import Flask, render_template, request, redirect, url_for, flash, jso
 import yaml
 import os
 import csv
-import subprocess
+import json
+import shutil
+from dataclasses import dataclass
 from werkzeug.utils import secure_filename
 
+try:
+    # C serializer; worthwhile for the frequently polled status endpoints
+    import orjson
+except ImportError:
+    orjson = None
+
 app = Flask(__name__)
 app.secret_key = 'posproctor-web-interface-key'
 app.config['UPLOAD_FOLDER'] = '/app/data'
@@ -15,43 +23,94 @@ CONFIG_FILE = '/app/data/config.yaml'
 CREDENTIALS_FILE = '/app/data/credentials.yaml'
 COMMANDERS_FILE = '/app/data/commanders.csv'  # This will be mounted as shared volume
 
-def load_config():
-    """Load configuration from YAML file"""
+def ojsonify(obj):
+    """jsonify via orjson when available, stdlib json otherwise"""
+    if orjson is not None:
+        return app.response_class(orjson.dumps(obj), mimetype='application/json')
+    return jsonify(obj)
+
+# Parsed-file cache keyed by mtime; dashboard requests between config edits
+# cost one stat call instead of a full YAML/CSV parse
+_CACHE = {'config': (None, None), 'credentials': (None, None), 'commanders': (None, None)}
+
+def _load_cached(key, path, parse, default):
+    """Return the parsed file, re-reading only when its mtime changes"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return default
+    cached_mtime, cached_value = _CACHE[key]
+    if mtime == cached_mtime:
+        return cached_value
     try:
-        with open(CONFIG_FILE, 'r') as f:
-            return yaml.safe_load(f)
+        with open(path, 'r') as f:
+            value = parse(f)
     except FileNotFoundError:
-        return {}
+        return default
+    except Exception:
+        # A malformed file shouldn't 500 every page until it's fixed
+        app.logger.exception(f'Failed to parse {path}')
+        return default
+    _CACHE[key] = (mtime, value)
+    return value
+
+def load_config():
+    """Load configuration from YAML file"""
+    return _load_cached('config', CONFIG_FILE, yaml.safe_load, {})
 
 def save_config(config):
     """Save configuration to YAML file"""
     with open(CONFIG_FILE, 'w') as f:
         yaml.dump(config, f, default_flow_style=False)
+    load_config()  # refresh the cache for the next request
 
 def load_credentials():
     """Load credentials from YAML file"""
-    try:
-        with open(CREDENTIALS_FILE, 'r') as f:
-            return yaml.safe_load(f)
-    except FileNotFoundError:
-        return {}
+    return _load_cached('credentials', CREDENTIALS_FILE, yaml.safe_load, {})
 
 def save_credentials(credentials):
     """Save credentials to YAML file"""
     with open(CREDENTIALS_FILE, 'w') as f:
         yaml.dump(credentials, f, default_flow_style=False)
+    load_credentials()  # refresh the cache for the next request
+
+@dataclass
+class CommandersView:
+    """Commander rows plus the dashboard stats, computed once at load"""
+    rows: list
+    enabled_count: int = 0
+    group_count: int = 0
+
+def _parse_commanders(f):
+    # csv.reader with presence-checked column indices; only the five columns
+    # the templates use become dict entries, and missing columns or short
+    # rows degrade to empty fields instead of raising — an uploaded CSV with
+    # an odd header must never take the dashboard down
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return CommandersView([])
+    idx = {name: i for i, name in enumerate(header)}
+    columns = [(name, idx[name]) for name in ('ip', 'store', 'group', 'brand', 'enabled') if name in idx]
+
+    rows = []
+    enabled_count = 0
+    groups = set()
+    for values in reader:
+        row = {name: '' for name in ('ip', 'store', 'group', 'brand', 'enabled')}
+        row.update((name, values[i]) for name, i in columns if i < len(values))
+        if row['enabled'].lower() == 'true':
+            enabled_count += 1
+        if row['group']:
+            groups.add(row['group'])
+        rows.append(row)
+    return CommandersView(rows, enabled_count, len(groups))
+
+_EMPTY_COMMANDERS = CommandersView([])
 
 def load_commanders():
     """Load commanders from CSV file"""
-    try:
-        commanders = []
-        with open(COMMANDERS_FILE, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                commanders.append(row)
-        return commanders
-    except FileNotFoundError:
-        return []
+    return _load_cached('commanders', COMMANDERS_FILE, _parse_commanders, _EMPTY_COMMANDERS)
 
 @app.route('/')
 def index():
@@ -70,9 +129,9 @@ def index():
     }
 
     stats = {
-        'total_stores': len(commanders),
-        'enabled_stores': len([c for c in commanders if c.get('enabled', '').lower() == 'true']),
-        'groups': len(set(c.get('group', '') for c in commanders if c.get('group')))
+        'total_stores': len(commanders.rows),
+        'enabled_stores': commanders.enabled_count,
+        'groups': commanders.group_count
     }
 
     return render_template('index.html', services=services, stats=stats, config=config)
@@ -144,7 +203,7 @@ def update_smtp():
 def commanders_page():
     """Commanders management page"""
     commanders = load_commanders()
-    return render_template('commanders.html', commanders=commanders)
+    return render_template('commanders.html', commanders=commanders.rows)
 
 @app.route('/commanders/upload', methods=['POST'])
 def upload_commanders():
@@ -158,9 +217,15 @@ def upload_commanders():
         flash('No file selected', 'error')
         return redirect(url_for('commanders_page'))
 
-    if file and file.filename.endswith('.csv'):
-        # Save the uploaded file
-        file.save(COMMANDERS_FILE)
+    filename = secure_filename(file.filename)
+    if filename.endswith('.csv'):
+        # Stream the upload to a temp file in 64KB chunks, then swap it in
+        # atomically so a concurrent load_commanders never sees a partial file
+        tmp_path = COMMANDERS_FILE + '.tmp'
+        with open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(file.stream, dst, length=65536)
+        os.replace(tmp_path, COMMANDERS_FILE)
+        load_commanders()  # refresh the cache for the next request
         flash('Commanders file uploaded successfully!', 'success')
     else:
         flash('Please upload a CSV file', 'error')
@@ -174,8 +239,8 @@ def api_status():
     config = load_config()
 
     status = {
-        'total_stores': len(commanders),
-        'enabled_stores': len([c for c in commanders if c.get('enabled', '').lower() == 'true']),
+        'total_stores': len(commanders.rows),
+        'enabled_stores': commanders.enabled_count,
         'scrape_interval': config.get('scrape_interval_minutes', 6),
         'services': {
             'grafana': True,  # Could add actual health checks here
@@ -184,7 +249,7 @@ def api_status():
         }
     }
 
-    return jsonify(status)
+    return ojsonify(status)
 
 @app.route('/api/services')
 def api_services():
@@ -197,24 +262,34 @@ def api_services():
         'loki_api': f'http://{host}:3100/ready',
         'web_interface': f'http://{host}:5000'
     }
-    return jsonify({'request_host': request.host, 'detected_host': host, 'service_urls': services})
+    return ojsonify({'request_host': request.host, 'detected_host': host, 'service_urls': services})
+
+# The restart endpoints always return the same content; encode it once
+_RESTART_MESSAGE = 'To restart POSProctor after configuration changes, run: docker-compose restart posproctor-app'
+_RESTART_JSON = (orjson.dumps if orjson is not None else lambda obj: json.dumps(obj).encode())({
+    'success': False,
+    'message': 'Automatic restart not available. Please run: docker-compose restart posproctor-app',
+    'instructions': 'docker-compose restart posproctor-app'
+})
 
 @app.route('/restart', methods=['POST'])
 def restart_posproctor():
     """Display restart instructions"""
-    flash('To restart POSProctor after configuration changes, run: docker-compose restart posproctor-app', 'info')
+    flash(_RESTART_MESSAGE, 'info')
     return redirect(url_for('config_page'))
 
 @app.route('/api/restart', methods=['POST'])
 def api_restart_posproctor():
     """API endpoint with restart instructions"""
-    return jsonify({
-        'success': False,
-        'message': 'Automatic restart not available. Please run: docker-compose restart posproctor-app',
-        'instructions': 'docker-compose restart posproctor-app'
-    })
+    return app.response_class(_RESTART_JSON, mimetype='application/json')
 
 if __name__ == '__main__':
     # Ensure data directory exists
     os.makedirs('/app/data', exist_ok=True)
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    try:
+        # Threaded production server; the dev server is single-threaded and
+        # pays debug-tracing overhead on every request
+        from waitress import serve
+        serve(app, host='0.0.0.0', port=5000, threads=8)
+    except ImportError:
+        app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file